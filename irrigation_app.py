@@ -1,10 +1,17 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter, Retry
 import json
+try:
+    import orjson  # 2-4x faster JSON decode; falls back to stdlib if missing
+except ImportError:
+    orjson = None
 import plotly.graph_objects as go
 import os
-import time # Needed for the retry logic
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # --- PAGE CONFIG ---
 st.set_page_config(page_title="FAO-56 Irrigation Audit", page_icon="💧", layout="wide")
@@ -13,18 +20,31 @@ st.title("💧 FAO-56 Smart Irrigation Auditor")
 st.markdown("**Precision Agriculture for Ghana** | Powered by Open-Meteo & FAO Data")
 
 # --- 1. LOAD DATABASE ---
-@st.cache_data
+# cache_resource shares ONE dict across all sessions (no per-call deep copy).
+# The returned dict must be treated as read-only -- never mutate it.
+@st.cache_resource
 def load_crop_db():
     try:
         if not os.path.exists('fao_crops.json'):
             return {}
-        with open('fao_crops.json', 'r') as f:
-            return json.load(f)
+        with open('fao_crops.json', 'rb') as f:
+            raw = f.read()
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
     except Exception:
         return {}
 
 crop_db = load_crop_db()
 
+# Precompute the selectbox option tuples once per process instead of
+# rebuilding list(...keys()) on every rerun; cache_resource hands back the
+# same objects, so Streamlit can skip re-diffing the widget options.
+@st.cache_resource
+def crop_index():
+    db = load_crop_db()
+    return tuple(db.keys()), {cat: tuple(crops.keys()) for cat, crops in db.items()}
+
+crop_categories, crops_by_category = crop_index()
+
 # --- SIDEBAR CONFIG ---
 st.sidebar.header("1. Field Location")
 
@@ -55,10 +75,9 @@ crop_name = "Standard Crop"
 kc = 1.0
 
 if crop_db:
-    category = st.sidebar.selectbox("Crop Category", list(crop_db.keys()))
-    if category in crop_db:
-        specific_crops = list(crop_db[category].keys())
-        crop_name = st.sidebar.selectbox("Select Crop", specific_crops)
+    category = st.sidebar.selectbox("Crop Category", crop_categories)
+    if category in crops_by_category:
+        crop_name = st.sidebar.selectbox("Select Crop", crops_by_category[category])
         
         stage_options = {
             "Initial (Planting/Seedling)": "init",
@@ -73,139 +92,307 @@ if crop_db:
 else:
     st.sidebar.warning("⚠️ Database 'fao_crops.json' not found. Using default Kc=1.0")
 
-st.sidebar.divider()
-st.sidebar.subheader("3. Pump Settings")
-pump_capacity = st.sidebar.number_input("Pump Capacity (Liters/min)", value=200)
-field_size = st.sidebar.number_input("Field Size (Acres)", value=1.0)
-
 # --- WEATHER ENGINE (ROBUST & CACHED) ---
-@st.cache_data(ttl=3600) # Cache data for 1 hour to prevent Error 429
+_FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+# Constant query fragment, built once; requests handles the URL encoding
+_PARAMS_FIXED = {
+    'daily': 'et0_fao_evapotranspiration,precipitation_sum',
+    'timezone': 'GMT',
+    'past_days': 2,
+    'forecast_days': 5
+}
+
+def _daily_to_df(daily):
+    # NumPy fast path: the API hands back ~7-element lists, so plain float32
+    # arrays beat the to_numeric/interpolate/fillna pandas chain.
+    # None values become NaN under the float cast.
+    eto = np.asarray(daily['et0_fao_evapotranspiration'], dtype=np.float32)
+    rain = np.asarray(daily['precipitation_sum'], dtype=np.float32)
+
+    # Fill small cloud gaps by linear interpolation; default if nothing usable
+    mask = np.isnan(eto)
+    if mask.all():
+        eto[:] = 3.5
+    elif mask.any():
+        eto[mask] = np.interp(np.flatnonzero(mask), np.flatnonzero(~mask), eto[~mask])
+    rain = np.nan_to_num(rain)
+
+    # Only materialize a DataFrame once, for display
+    return pd.DataFrame({
+        "Date": pd.to_datetime(daily['time']),
+        "ETo": eto,
+        "Rain": rain
+    })
+
+@st.cache_resource
+def get_http():
+    # One pooled Session shared across reruns/sessions: keep-alive skips the
+    # TLS handshake on repeat calls, and the adapter handles 429 retries.
+    session = requests.Session()
+    # Ask for compressed bodies explicitly. Only gzip: advertising br without
+    # a brotli decoder installed would hand orjson raw compressed bytes.
+    session.headers.update({'Accept-Encoding': 'gzip'})
+    retries = Retry(total=3, backoff_factor=1,
+                    status_forcelist=[429, 502, 503, 504],
+                    respect_retry_after_header=True)
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                          max_retries=retries))
+    return session
+
+# Single-flight guard: st.cache_data does not dedupe in-flight misses, so two
+# users auditing the same site at once would both hit the API. The first call
+# per key fetches; concurrent ones wait on its Event and then hit the cache.
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Conditional-GET bookkeeping per (lat, lon): the Last-Modified stamp and the
+# frame it produced, so a 304 answer skips JSON parsing entirely. Bounded in
+# practice by the handful of scheme coordinates.
+_last_modified = {}
+_last_df = {}
+
+# persist="disk" keeps entries across restarts/workers; max_entries bounds disk growth.
+@st.cache_data(ttl=3600, persist="disk", max_entries=256, show_spinner=False) # Cache data for 1 hour to prevent Error 429
+def _fetch_weather(lat, lon):
+    # Expects pre-rounded coordinates (see get_weather_data_safe)
+    try:
+        # Conditional GET: if we have seen this key, let the server answer
+        # 304 Not Modified instead of resending the body
+        headers = {}
+        if (lat, lon) in _last_modified and (lat, lon) in _last_df:
+            headers['If-Modified-Since'] = _last_modified[(lat, lon)]
+
+        response = get_http().get(_FORECAST_URL,
+                                  params={**_PARAMS_FIXED, 'latitude': lat, 'longitude': lon},
+                                  headers=headers,
+                                  timeout=10)
+        if response.status_code == 304:
+            return _last_df[(lat, lon)].copy()
+        response.raise_for_status()
+        # orjson decodes the raw bytes 2-5x faster than response.json()
+        data = orjson.loads(response.content) if orjson is not None else response.json()
+        df = _daily_to_df(data['daily'])
+        if 'Last-Modified' in response.headers:
+            _last_modified[(lat, lon)] = response.headers['Last-Modified']
+            _last_df[(lat, lon)] = df
+        return df
+
+    except requests.exceptions.RequestException:
+        # Retries (with backoff) already happened inside the adapter
+        st.error("⚠️ Weather Satellite is busy. Please wait a minute and try again.")
+        return pd.DataFrame()
+
 def get_weather_data_safe(lat, lon):
-    # Manual URL construction to prevent 'int+str' error
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&daily=et0_fao_evapotranspiration,precipitation_sum&timezone=GMT&past_days=2&forecast_days=5"
-    
-    # Retry Logic: Try 3 times before giving up
-    for attempt in range(3):
-        try:
-            response = requests.get(url, timeout=10)
-            
-            # If server says "Too Many Requests" (429), trigger the retry logic
-            if response.status_code == 429:
-                response.raise_for_status()
-                
-            response.raise_for_status()
-            data = response.json()
-            
-            df = pd.DataFrame({
-                "Date": data['daily']['time'],
-                "ETo": data['daily']['et0_fao_evapotranspiration'],
-                "Rain": data['daily']['precipitation_sum']
-            })
-            
-            # Safe Data Conversion
-            df['Date'] = pd.to_datetime(df['Date'])
-            
-            # Interpolate to fill small gaps (clouds), fill remaining NaNs with defaults
-            df['ETo'] = pd.to_numeric(df['ETo'], errors='coerce').interpolate().fillna(3.5)
-            df['Rain'] = pd.to_numeric(df['Rain'], errors='coerce').fillna(0.0)
-            
-            return df
-            
-        except requests.exceptions.RequestException as e:
-            # If it's a 429 or connection error, wait and try again
-            time.sleep(2 ** attempt) # Wait 1s, then 2s, then 4s
-            continue
-            
-    # If all 3 attempts fail
-    st.error("⚠️ Weather Satellite is busy. Please wait a minute and try again.")
-    return pd.DataFrame()
+    # Round HERE, not inside the cached function: st.cache_data keys on the
+    # arguments as passed, so nearby custom coordinates only share an entry
+    # if they are normalized before the cached call (~100m precision).
+    lat, lon = round(lat, 3), round(lon, 3)
+
+    # Single-flight sits OUTSIDE the cached function: the owner's cache entry
+    # is stored when _fetch_weather returns, i.e. before the Event is set, so
+    # woken waiters are guaranteed a warm cache.
+    with _inflight_lock:
+        evt = _inflight.get((lat, lon))
+        if evt is None:
+            _inflight[(lat, lon)] = threading.Event()
+
+    if evt is not None:
+        # Wait longer than the worst-case retry ladder (3 tries x 10s
+        # timeout plus backoff) so we never race the owner.
+        evt.wait(timeout=60)
+        return _fetch_weather(lat, lon)
+
+    try:
+        return _fetch_weather(lat, lon)
+    finally:
+        with _inflight_lock:
+            _inflight.pop((lat, lon)).set()
+
+def get_weather_batch(locs):
+    # Fan out per-site fetches so a multi-scheme audit is bounded by the
+    # slowest single call, not the sum. Cached sites return instantly.
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        results = list(ex.map(lambda p: get_weather_data_safe(*p), locs))
+    return {(lat, lon): df for (lat, lon), df in zip(locs, results)}
+
+@st.cache_data(ttl=3600, persist="disk", max_entries=64, show_spinner=False)
+def _fetch_weather_multi(locs):
+    # One round-trip for all sites: Open-Meteo accepts comma-separated
+    # latitude/longitude lists and answers with one block per site.
+    # Expects pre-rounded pairs (see get_weather_multi).
+    lats = ','.join(str(lat) for lat, _ in locs)
+    lons = ','.join(str(lon) for _, lon in locs)
+
+    try:
+        response = get_http().get(_FORECAST_URL,
+                                  params={**_PARAMS_FIXED, 'latitude': lats, 'longitude': lons},
+                                  timeout=10)
+        response.raise_for_status()
+        data = orjson.loads(response.content) if orjson is not None else response.json()
+
+        # Multi-coordinate queries return a list of per-site objects;
+        # a single coordinate returns one bare object.
+        blocks = data if isinstance(data, list) else [data]
+
+        return {loc: _daily_to_df(block['daily']) for loc, block in zip(locs, blocks)}
+
+    except requests.exceptions.RequestException:
+        st.error("⚠️ Weather Satellite is busy. Please wait a minute and try again.")
+        return {}
+
+def get_weather_multi(locs):
+    # Normalize the pairs before the cached call -- st.cache_data keys on the
+    # arguments as passed, same reason as get_weather_data_safe.
+    return _fetch_weather_multi(tuple((round(lat, 3), round(lon, 3)) for lat, lon in locs))
+
+# --- CHART BUILDER (MEMOIZED) ---
+# Takes plain tuples (cheap to hash) instead of the DataFrame so identical
+# audit inputs reuse the built figure rather than paying the three-trace
+# go.Figure construction on every rerun.
+@st.cache_data(show_spinner=False)
+def build_fig(dates, rain, crop_need, irrigation_req, today_str):
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=dates, y=rain, name='Rainfall', marker_color='#3b82f6'))
+    fig.add_trace(go.Bar(x=dates, y=crop_need, name='Crop Thirst', marker_color='#f97316', opacity=0.7))
+    # WebGL trace paints faster than SVG, noticeably so on mobile field devices
+    fig.add_trace(go.Scattergl(x=dates, y=irrigation_req, name='Irrigation Needed',
+                               line=dict(color='#ef4444', width=3), mode='lines+markers'))
+
+    # Add the vertical line (no annotation here to avoid the bug)
+    fig.add_vline(x=today_str, line_dash="dash", line_color="green")
+
+    # Add the annotation separately, positioned at the top of the plot
+    fig.add_annotation(
+        x=today_str,
+        y=1,  # Top of the plot
+        yref="paper",  # Relative to the entire figure height (0=bottom, 1=top)
+        text="Today",
+        showarrow=False,
+        font=dict(color="green", size=12),
+        align="center",
+        yanchor="bottom"  # Anchor below the text to avoid overlapping the top edge
+    )
+
+    fig.update_layout(height=400, margin=dict(t=20, b=20), hovermode="x unified", legend=dict(orientation="h", y=1.1))
+    return fig
 
 # --- MAIN LOGIC ---
-if st.button("Run Irrigation Audit", type="primary"):
+# Fragment: edits to the widgets below rerun only this block, not the whole
+# script (sidebar, crop_db lookup etc. stay untouched).
+@st.fragment
+def audit_fragment(lat, lon, kc, location_name, crop_name):
+    st.subheader("3. Pump Settings")
+    pump_col1, pump_col2 = st.columns(2)
+    # min_value keeps the pump-hours division finite (0 L/min would give inf)
+    pump_capacity = pump_col1.number_input("Pump Capacity (Liters/min)", value=200, min_value=1)
+    field_size = pump_col2.number_input("Field Size (Acres)", value=1.0, min_value=0.0)
+
+    run_clicked = st.button("Run Irrigation Audit", type="primary")
+
+    # Weather from the last audit lives in session_state, so pump-setting
+    # tweaks re-run only the arithmetic below -- no network, no refetch.
+    have_state = st.session_state.get('weather_key') == (lat, lon)
+    if not run_clicked and not have_state:
+        return
+
     display_name = crop_name if crop_name else "Unknown Crop"
-    
-    with st.spinner(f"🛰️ Auditing {display_name} in {location_name}..."):
-        # 1. Get Data
-        df = get_weather_data_safe(lat, lon)
-        
-        if not df.empty:
-            try:
-                # 2. Calculate Balance
-                df['Crop_Water_Need'] = df['ETo'] * float(kc)
-                df['Irrigation_Req'] = (df['Crop_Water_Need'] - df['Rain']).clip(lower=0)
-                
-                # 3. Calculate Pump Time
-                total_liters = df['Irrigation_Req'] * 4046.86 * float(field_size)
-                df['Pump_Hours'] = total_liters / (int(pump_capacity) * 60)
-                
-                # --- DASHBOARD UI ---
-                today = df.iloc[2]
-                
-                col1, col2, col3, col4 = st.columns(4)
-                col1.metric("Today's Rain", f"{today['Rain']:.1f} mm")
-                col2.metric("Crop Thirst (ETc)", f"{today['Crop_Water_Need']:.1f} mm")
-                col3.metric("Irrigation Needed", f"{today['Irrigation_Req']:.1f} mm", 
-                            delta="Deficit" if today['Irrigation_Req'] > 0 else "Balanced", delta_color="inverse")
-                
-                hrs = int(today['Pump_Hours'])
-                mins = int((today['Pump_Hours'] % 1) * 60)
-                col4.metric("Pump Runtime", f"{hrs}h {mins}m")
-
-                st.divider()
-
-                col_chart, col_advice = st.columns([2, 1])
-                
-                with col_chart:
-                    st.subheader("7-Day Water Balance")
-                    fig = go.Figure()
-                    fig.add_trace(go.Bar(x=df['Date'], y=df['Rain'], name='Rainfall', marker_color='#3b82f6'))
-                    fig.add_trace(go.Bar(x=df['Date'], y=df['Crop_Water_Need'], name='Crop Thirst', marker_color='#f97316', opacity=0.7))
-                    fig.add_trace(go.Scatter(x=df['Date'], y=df['Irrigation_Req'], name='Irrigation Needed', 
-                                           line=dict(color='#ef4444', width=3), mode='lines+markers'))
-                    
-                    # FIX: Convert Timestamp to String to prevent Pandas/Plotly math conflict
-                    today_str = today['Date'].strftime('%Y-%m-%d')
-                    
-                    # Add the vertical line (no annotation here to avoid the bug)
-                    fig.add_vline(x=today_str, line_dash="dash", line_color="green")
-                    
-                    # Add the annotation separately, positioned at the top of the plot
-                    fig.add_annotation(
-                        x=today_str,
-                        y=1,  # Top of the plot
-                        yref="paper",  # Relative to the entire figure height (0=bottom, 1=top)
-                        text="Today",
-                        showarrow=False,
-                        font=dict(color="green", size=12),
-                        align="center",
-                        yanchor="bottom"  # Anchor below the text to avoid overlapping the top edge
-                    )
-                    
-                    fig.update_layout(height=400, margin=dict(t=20, b=20), hovermode="x unified", legend=dict(orientation="h", y=1.1))
-                    st.plotly_chart(fig, use_container_width=True)
-
-                with col_advice:
-                    st.subheader("📝 Recommendation")
-                    if today['Irrigation_Req'] > 0:
-                        st.error(f"""
-                        **Status: WATER STRESS**
-                        Plan: Run pump for **{hrs}h {mins}m**.
-                        Apply **{int(total_liters.iloc[2])} Liters**.
-                        """)
-                    else:
-                        st.success("**Status: ADEQUATE.** No irrigation needed.")
-                    
-                    with st.expander("Data Table"):
-                        st.dataframe(df.style.format({
-                            "ETo": "{:.2f}",
-                            "Rain": "{:.1f}",
-                            "Crop_Water_Need": "{:.1f}",
-                            "Irrigation_Req": "{:.1f}",
-                            "Pump_Hours": "{:.2f}"
-                        }))
-
-            except Exception as e:
-                st.error(f"Calculation Error: {e}")
-
-            st.divider()
+
+    # Skeleton first: paint the four metric cards immediately so the dashboard
+    # has its final shape while the weather call is still in flight.
+    slots = [col.empty() for col in st.columns(4)]
+    slots[0].metric("Today's Rain", "—")
+    slots[1].metric("Crop Thirst (ETc)", "—")
+    slots[2].metric("Irrigation Needed", "—")
+    slots[3].metric("Pump Runtime", "—")
+
+    if run_clicked:
+        with st.spinner(f"🛰️ Auditing {display_name} in {location_name}..."):
+            # 1. Get Data
+            fresh = get_weather_data_safe(lat, lon)
+        if fresh.empty:
+            st.session_state.pop('weather_key', None)
+            return
+        st.session_state['weather_df'] = fresh
+        st.session_state['weather_key'] = (lat, lon)
+
+    df = st.session_state['weather_df']
+
+    # Guard explicitly instead of a broad try/except: index 2 is "today"
+    # (two past days precede it), so anything shorter is unusable.
+    if len(df) < 3:
+        st.error("Insufficient data: the weather service returned a short forecast.")
+        return
+
+    # 2. Calculate Balance (vectorized on raw arrays)
+    crop_need = df['ETo'].to_numpy() * np.float32(kc)
+    irrigation_req = np.clip(crop_need - df['Rain'].to_numpy(), 0, None)
+
+    # 3. Calculate Pump Time (float32 constants so nothing widens to
+    # float64 -- halves the bytes Plotly/Arrow ship to the browser)
+    total_liters = irrigation_req * np.float32(4046.86) * np.float32(field_size)
+    df['Crop_Water_Need'] = crop_need
+    df['Irrigation_Req'] = irrigation_req
+    df['Pump_Hours'] = total_liters / np.float32(int(pump_capacity) * 60)
+
+    # --- DASHBOARD UI (fill the skeleton slots) ---
+    # .iat scalar reads beat row materialization via .iloc[2]
+    today_rain = float(df['Rain'].iat[2])
+    today_need = float(df['Crop_Water_Need'].iat[2])
+    today_irr = float(df['Irrigation_Req'].iat[2])
+    today_hours = float(df['Pump_Hours'].iat[2])
+
+    slots[0].metric("Today's Rain", f"{today_rain:.1f} mm")
+    slots[1].metric("Crop Thirst (ETc)", f"{today_need:.1f} mm")
+    slots[2].metric("Irrigation Needed", f"{today_irr:.1f} mm",
+                delta="Deficit" if today_irr > 0 else "Balanced", delta_color="inverse")
+
+    hrs = int(today_hours)
+    mins = int((today_hours % 1) * 60)
+    slots[3].metric("Pump Runtime", f"{hrs}h {mins}m")
+
+    st.divider()
+
+    col_chart, col_advice = st.columns([2, 1])
+
+    with col_chart:
+        st.subheader("7-Day Water Balance")
+        chart_slot = st.empty()
+        # FIX: Convert Timestamps to Strings to prevent Pandas/Plotly math conflict
+        today_str = df['Date'].iat[2].strftime('%Y-%m-%d')
+        # Round for display: a bare float(np.float32) drags representation
+        # noise (4.3 -> 4.300000190734863) into the Plotly hover labels
+        fig = build_fig(
+            tuple(df['Date'].dt.strftime('%Y-%m-%d')),
+            tuple(round(float(v), 2) for v in df['Rain']),
+            tuple(round(float(v), 2) for v in df['Crop_Water_Need']),
+            tuple(round(float(v), 2) for v in df['Irrigation_Req']),
+            today_str
+        )
+        chart_slot.plotly_chart(fig, use_container_width=True)
+
+    with col_advice:
+        st.subheader("📝 Recommendation")
+        if today_irr > 0:
+            st.error(f"""
+            **Status: WATER STRESS**
+            Plan: Run pump for **{hrs}h {mins}m**.
+            Apply **{int(total_liters[2])} Liters**.
+            """)
+        else:
+            st.success("**Status: ADEQUATE.** No irrigation needed.")
+
+        with st.expander("Data Table"):
+            # column_config formats on the Arrow path -- no Styler HTML render
+            st.dataframe(df, column_config={
+                "ETo": st.column_config.NumberColumn(format="%.2f"),
+                "Rain": st.column_config.NumberColumn(format="%.1f"),
+                "Crop_Water_Need": st.column_config.NumberColumn(format="%.1f"),
+                "Irrigation_Req": st.column_config.NumberColumn(format="%.1f"),
+                "Pump_Hours": st.column_config.NumberColumn(format="%.2f")
+            }, hide_index=True)
+
+    st.divider()
+
+audit_fragment(lat, lon, kc, location_name, crop_name)
+
 st.markdown("<p style='text-align: center; color: #888888;'>© 2025 Agyei Darko | Smart Irrigation Auditor </p>", unsafe_allow_html=True)
\ No newline at end of file
@@ -1,6 +1,6 @@
 import requests
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
 
 
 # Location: Tono Irrigation Dam, Navrongo, Ghana
@@ -36,26 +36,30 @@ try:
     response = requests.get(url, params=params)
     data = response.json()
     
-    # Organize the messy JSON into a clean Table (DataFrame)
     daily = data['daily']
+    kc_value = CROPS[CURRENT_CROP]["kc"]
+
+    # Do the water balance on plain NumPy arrays (float32) -- the math is
+    # trivial, so skip the per-column pandas machinery entirely
+    eto = np.asarray(daily['et0_fao_evapotranspiration'], dtype=np.float32)
+    rain = np.asarray(daily['precipitation_sum'], dtype=np.float32)
+
+    # ETc = ETo * Kc
+    need = eto * np.float32(kc_value)
+
+    # Irrigation Needed = Crop Need - Rain, floored at 0
+    # (we don't suck water out of the ground!)
+    irrigation = np.clip(need - rain, 0, None)
+
+    # Organize into a clean Table (DataFrame) only for display
     df = pd.DataFrame({
         "Date": daily['time'],
         "Temp_Max": daily['temperature_2m_max'],
-        "Rain (mm)": daily['precipitation_sum'],
-        "ETo (mm)": daily['et0_fao_evapotranspiration']
+        "Rain (mm)": rain,
+        "ETo (mm)": eto,
+        "Crop_Need (mm)": need,
+        "Irrigation_Needed (mm)": irrigation
     })
-    
-    #  CALCULATE CROP WATER NEED (ETc) ---
-    kc_value = CROPS[CURRENT_CROP]["kc"]
-    
-    # ETc = ETo * Kc
-    df["Crop_Need (mm)"] = df["ETo (mm)"] * kc_value
-    
-    #  CALCULATE IRRIGATION REQUIREMENT ---
-    # Irrigation Needed = Crop Need - Rain
-    # If rain > need, irrigation is 0 (we don't suck water out of the ground!)
-    df["Irrigation_Needed (mm)"] = df["Crop_Need (mm)"] - df["Rain (mm)"]
-    df["Irrigation_Needed (mm)"] = df["Irrigation_Needed (mm)"].clip(lower=0) # No negative numbers
 
     # DISPLAY RESULTS ---
     print("\n📊 WEEKLY WATER AUDIT")
@@ -64,6 +68,12 @@ try:
     print(df[["Date", "Rain (mm)", "Crop_Need (mm)", "Irrigation_Needed (mm)"]].to_string(index=False))
     
     #  VISUALIZATION ---
+    # Import matplotlib only once we have data to plot, and force the Agg
+    # backend: we only savefig, so GUI backend init is wasted time
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 6))
     
     # Bar chart for water balance
@@ -85,7 +95,6 @@ try:
     plt.tight_layout()
     plt.savefig("Irrigation_Plan.png")
     print(f"\n💾 Chart saved as 'Irrigation_Plan.png'")
-    plt.show()
 
 except Exception as e:
     print(f"❌ Error fetching weather data: {e}")
\ No newline at end of file